@@ -11,6 +11,7 @@ Environment Variables:
 - LEAK_INTERVAL: Interval between allocations in seconds (default: 1)
 - MAX_MEMORY: Maximum memory to allocate in MB (default: 500)
 - PORT: HTTP server port (default: 8080)
+- ACCESS_LOG: Set to "TRUE" to log every HTTP request (default: FALSE)
 
 Security Features:
 - Runs as non-root user
@@ -25,12 +26,26 @@ import time
 import threading
 import logging
 import signal
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from http import HTTPStatus
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 import json
-from datetime import datetime
-import gc
+import array
+import ctypes
+import errno
+import mmap
 import psutil
 
+try:
+    import orjson
+    
+    def _dumps(data):
+        """Encode data as compact JSON bytes"""
+        return orjson.dumps(data)
+except ImportError:  # orjson is optional; fall back to the stdlib encoder
+    def _dumps(data):
+        """Encode data as compact JSON bytes"""
+        return json.dumps(data, separators=(',', ':')).encode()
+
 # Configure structured logging for Azure monitoring
 logging.basicConfig(
     level=logging.INFO,
@@ -41,6 +56,42 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# madvise() advice that prefaults pages for writing (Linux 5.14+); the mmap
+# module does not export it
+MADV_POPULATE_WRITE = getattr(mmap, 'MADV_POPULATE_WRITE', 23)
+ANON_MAP_FLAGS = mmap.MAP_PRIVATE | mmap.MAP_ANONYMOUS
+
+# glibc, used to hand freed heap back to the kernel after a cleanup
+try:
+    _libc = ctypes.CDLL('libc.so.6', use_errno=True)
+except OSError:  # Not a glibc system; heap trimming is skipped
+    _libc = None
+
+# How long a /metrics snapshot is reused before psutil is queried again
+STATS_CACHE_TTL = 0.25  # seconds
+
+# Response head written in the same buffer as the body. The protocol matches
+# BaseHTTPRequestHandler's default, which closes the connection afterwards;
+# Connection: close says so explicitly and Content-Length delimits the body.
+RESPONSE_HEAD = (b'HTTP/1.0 %d %b\r\n'
+                 b'Content-Type: application/json\r\n'
+                 b'Content-Length: %d\r\n'
+                 b'Connection: close\r\n'
+                 b'\r\n')
+
+def _build_response(status_code, body):
+    """Assemble a complete HTTP response (head and JSON body) as bytes"""
+    status = HTTPStatus(status_code)
+    return RESPONSE_HEAD % (status, status.phrase.encode(), len(body)) + body
+
+# Complete probe responses, built once; while the app is running these bodies
+# never change, so /health and /ready are answered with a single write
+HEALTH_OK = _build_response(200, b'{"status":"healthy","running":true}')
+READY_OK = _build_response(200, b'{"status":"ready"}')
+NOT_READY = _build_response(503, b'{"status":"not ready"}')
+# Liveness body while shutting down; only the timestamp is filled in
+STOPPING_BODY = b'{"status":"healthy","timestamp":"%b","running":false}'
+
 class MemoryLeakApp:
     """
     Memory leak simulation application with configurable behavior.
@@ -59,12 +110,45 @@ class MemoryLeakApp:
         self.leak_interval = max(0.1, min(10, float(os.getenv('LEAK_INTERVAL', '1'))))  # Limit between 0.1-10 seconds
         self.max_memory_mb = max(10, min(2048, int(os.getenv('MAX_MEMORY', '500'))))  # Limit between 10-2048 MB
         self.port = int(os.getenv('PORT', '8080'))
+        self.access_log = os.getenv('ACCESS_LOG', 'FALSE').upper() == 'TRUE'
+        
+        # Slab pool: a fixed number of leak_rate_mb sized slots, handed out
+        # from a free-list stack so allocation bookkeeping is O(1). Slabs are
+        # only materialized when a slot is taken, so an idle pod stays small.
+        self._pool = [None] * (self.max_memory_mb // self.leak_rate_mb)
+        self._slab_bytes = self.leak_rate_mb << 20  # 1MB = 1024*1024 bytes
+        self._use_thp = True  # Cleared after the first failed THP populate
+        self._free = list(range(len(self._pool)))
+        # Indices of the slabs in use, in allocation order; _head slots are filled
+        self._slots = array.array('L', [0]) * len(self._pool)
+        self._head = 0
+        self._chunks_lock = threading.Lock()  # Leak schedule and /cleanup race on the pool
+        self._next_alloc = 0.0  # Monotonic deadline of the next leak allocation
         
         # Application state
-        self.memory_chunks = []
         self.running = True
-        self.start_time = datetime.now()
-        self.current_memory_mb = 0
+        self._start_mono = time.monotonic()  # Uptime is immune to clock changes
+        self._proc = psutil.Process()  # Reused across /metrics requests
+        self._stats_cache = (0.0, None)  # (monotonic timestamp, stats dict)
+        self._stats_lock = threading.Lock()
+        self._ts_cache = (0, b'')  # (epoch second, formatted date and time)
+        
+        # / response body, encoded once at startup from the config above
+        self.root_body = _dumps({
+            "app": "Memory Leak Test Application",
+            "version": "1.0",
+            "endpoints": {
+                "/health": "Liveness probe",
+                "/ready": "Readiness probe",
+                "/metrics": "Memory metrics",
+                "/cleanup": "Manual memory cleanup"
+            },
+            "config": {
+                "leak_enabled": self.leak_enabled,
+                "max_memory_mb": self.max_memory_mb,
+                "leak_rate_mb": self.leak_rate_mb
+            }
+        })
         
         # Setup signal handlers for graceful shutdown
         signal.signal(signal.SIGTERM, self._signal_handler)
@@ -75,38 +159,91 @@ class MemoryLeakApp:
                    f"leak_rate={self.leak_rate_mb}MB/s, "
                    f"leak_interval={self.leak_interval}s, "
                    f"max_memory={self.max_memory_mb}MB, "
-                   f"port={self.port}")
+                   f"port={self.port}, "
+                   f"access_log={self.access_log}")
     
     def _signal_handler(self, signum, frame):
         """Handle shutdown signals gracefully"""
         logger.info(f"Received signal {signum}, initiating graceful shutdown...")
         self.running = False
     
-    def _allocate_memory_chunk(self, size_mb):
+    def timestamp(self):
+        """
+        Current local time in ISO 8601 format, like datetime.isoformat().
+        
+        The date and time of day are formatted at most once per second;
+        only the microseconds are rendered per call.
+        
+        Returns:
+            bytes: Timestamp such as b'2024-01-01T12:00:00.123456'
+        """
+        now = time.time()
+        sec = int(now)
+        cached_sec, base = self._ts_cache
+        if sec != cached_sec:
+            base = time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(sec)).encode()
+            self._ts_cache = (sec, base)
+        return b'%b.%06d' % (base, int((now - sec) * 1e6))
+    
+    def _map_slab(self, size):
         """
-        Allocate memory chunk of specified size.
+        Map an anonymous slab and make every page resident.
+        
+        The mapping is marked for transparent hugepages before it is
+        populated. This only helps slabs of at least 2MB (LEAK_RATE >= 2):
+        the kernel can back each 2MB-aligned part of such a slab with one
+        hugepage, committing it in one fault rather than 512. Smaller slabs,
+        and kernels that do not align anonymous mappings to 2MB, get plain
+        4KB pages. Unlike MAP_HUGETLB, THP memory is charged to the
+        container's memory cgroup, so the leak still counts against
+        Kubernetes limits.
         
         Args:
-            size_mb (int): Size in megabytes to allocate
+            size (int): Slab size in bytes
             
+        Returns:
+            mmap.mmap: The populated mapping
+        """
+        if self._use_thp:
+            slab = mmap.mmap(-1, size, flags=ANON_MAP_FLAGS)
+            try:
+                slab.madvise(mmap.MADV_HUGEPAGE)
+                slab.madvise(MADV_POPULATE_WRITE)
+                return slab
+            except OSError as e:
+                slab.close()
+                if e.errno != errno.EINVAL:
+                    # Transient (ENOMEM under cgroup pressure, EINTR, ...):
+                    # fail just this allocation and keep using THP
+                    raise
+                # THP or MADV_POPULATE_WRITE unsupported; don't retry every tick
+                self._use_thp = False
+        # Let mmap prefault 4KB pages
+        return mmap.mmap(-1, size, flags=ANON_MAP_FLAGS | mmap.MAP_POPULATE)
+    
+    def _allocate_memory_chunk(self):
+        """
+        Take one leak_rate_mb sized slab from the pool.
+        
         Returns:
             bool: True if allocation successful, False otherwise
         """
+        size_mb = self.leak_rate_mb
         try:
-            if self.current_memory_mb + size_mb > self.max_memory_mb:
-                logger.warning(f"Memory allocation would exceed limit ({self.max_memory_mb}MB)")
-                return False
-            
-            # Allocate memory chunk (1MB = 1024*1024 bytes)
-            chunk = bytearray(size_mb * 1024 * 1024)
-            # Fill with data to ensure actual memory allocation
-            for i in range(0, len(chunk), 4096):
-                chunk[i] = i % 256
-            
-            self.memory_chunks.append(chunk)
-            self.current_memory_mb += size_mb
+            with self._chunks_lock:
+                if not self._free:
+                    logger.warning(f"Memory allocation would exceed limit ({self.max_memory_mb}MB)")
+                    return False
+                
+                chunk = self._map_slab(self._slab_bytes)
+                
+                idx = self._free.pop()
+                self._pool[idx] = chunk
+                self._slots[self._head] = idx
+                self._head += 1
+                total_mb = self._head * size_mb
             
-            logger.info(f"Allocated {size_mb}MB, total allocated: {self.current_memory_mb}MB")
+            logger.info("Allocated %dMB, total allocated: %dMB", size_mb, total_mb)
             return True
             
         except MemoryError as e:
@@ -116,27 +253,38 @@ class MemoryLeakApp:
             logger.error(f"Unexpected error during memory allocation: {e}")
             return False
     
-    def _memory_leak_worker(self):
+    def memory_leak_tick(self):
         """
-        Background worker that simulates memory leak behavior.
-        Runs in separate thread to allow HTTP server to remain responsive.
+        Allocate the next chunk once the leak schedule is due.
+        
+        Called from the HTTP server loop after every request or wait, so the
+        leak needs no thread of its own; a monotonic deadline paces the
+        allocations.
+        
+        Returns:
+            float: Seconds until the next allocation is due, or None if the
+            leak is disabled
         """
-        logger.info("Memory leak worker started")
+        if not (self.running and self.leak_enabled):
+            return None
         
-        while self.running and self.leak_enabled:
-            try:
-                if not self._allocate_memory_chunk(self.leak_rate_mb):
-                    logger.warning("Memory allocation failed or limit reached")
-                    # Wait longer before retrying
-                    time.sleep(self.leak_interval * 5)
-                else:
-                    time.sleep(self.leak_interval)
-                    
-            except Exception as e:
-                logger.error(f"Error in memory leak worker: {e}")
-                time.sleep(self.leak_interval)
+        now = time.monotonic()
+        if now < self._next_alloc:
+            return self._next_alloc - now
+        
+        try:
+            if not self._allocate_memory_chunk():
+                logger.warning("Memory allocation failed or limit reached")
+                # Wait longer before retrying
+                self._next_alloc = now + self.leak_interval * 5
+            else:
+                self._next_alloc = now + self.leak_interval
+                
+        except Exception as e:
+            logger.error(f"Error in memory leak schedule: {e}")
+            self._next_alloc = now + self.leak_interval
         
-        logger.info("Memory leak worker stopped")
+        return max(0.0, self._next_alloc - time.monotonic())
     
     def get_memory_stats(self):
         """
@@ -145,31 +293,61 @@ class MemoryLeakApp:
         Returns:
             dict: Memory statistics including system and process metrics
         """
+        with self._stats_lock:
+            cached_at, stats = self._stats_cache
+            if stats is not None and time.monotonic() - cached_at < STATS_CACHE_TTL:
+                return stats
+        
         try:
-            process = psutil.Process()
-            memory_info = process.memory_info()
+            with self._proc.oneshot():
+                memory_info = self._proc.memory_info()
+                memory_percent = self._proc.memory_percent()
             
-            return {
-                "allocated_chunks": len(self.memory_chunks),
-                "allocated_memory_mb": self.current_memory_mb,
+            chunk_count = self._head
+            stats = {
+                "allocated_chunks": chunk_count,
+                "allocated_memory_mb": chunk_count * self.leak_rate_mb,
                 "process_memory_mb": round(memory_info.rss / 1024 / 1024, 2),
                 "process_virtual_memory_mb": round(memory_info.vms / 1024 / 1024, 2),
-                "memory_percent": round(process.memory_percent(), 2),
-                "uptime_seconds": int((datetime.now() - self.start_time).total_seconds()),
+                "memory_percent": round(memory_percent, 2),
+                "uptime_seconds": int(time.monotonic() - self._start_mono),
                 "leak_enabled": self.leak_enabled,
                 "max_memory_mb": self.max_memory_mb
             }
         except Exception as e:
             logger.error(f"Error getting memory stats: {e}")
             return {"error": str(e)}
+        
+        with self._stats_lock:
+            self._stats_cache = (time.monotonic(), stats)
+        return stats
     
     def cleanup_memory(self):
-        """Clean up allocated memory chunks"""
+        """
+        Clean up allocated memory chunks.
+        
+        Slabs are unmapped and the malloc heap is trimmed, so the drop in
+        RSS is visible to the kubelet and to container memory limits.
+        
+        Returns:
+            bool: True if cleanup successful, False otherwise
+        """
         try:
-            chunk_count = len(self.memory_chunks)
-            self.memory_chunks.clear()
-            self.current_memory_mb = 0
-            gc.collect()  # Force garbage collection
+            with self._chunks_lock:
+                chunk_count = self._head
+                in_use = self._slots[:chunk_count]
+                for idx in in_use:
+                    self._pool[idx].close()  # munmap returns the pages to the OS
+                    self._pool[idx] = None
+                self._free.extend(in_use)
+                self._head = 0
+            with self._stats_lock:
+                self._stats_cache = (0.0, None)  # Next /metrics reflects the cleanup
+            if _libc is not None:
+                try:
+                    _libc.malloc_trim(0)  # Release free arena pages to the OS
+                except AttributeError:  # libc without malloc_trim
+                    pass
             
             logger.info(f"Cleaned up {chunk_count} memory chunks")
             return True
@@ -180,51 +358,49 @@ class MemoryLeakApp:
 class HealthCheckHandler(BaseHTTPRequestHandler):
     """HTTP request handler for health checks and monitoring endpoints"""
     
+    # GET path -> handler method name
+    _ROUTES = {
+        '/health': '_handle_health',
+        '/ready': '_handle_readiness',
+        '/metrics': '_handle_metrics',
+        '/cleanup': '_handle_cleanup',
+        '/': '_handle_root',
+    }
+    
     def __init__(self, app, *args, **kwargs):
         self.app = app
         super().__init__(*args, **kwargs)
     
     def log_message(self, format, *args):
-        """Override to use structured logging"""
-        logger.info(f"HTTP {self.command} {self.path} - {format % args}")
+        """Override to use structured logging; silent unless ACCESS_LOG is set"""
+        if self.app.access_log and logger.isEnabledFor(logging.INFO):
+            logger.info("HTTP %s %s - %s", self.command, self.path, format % args)
+    
+    def log_error(self, format, *args):
+        """Report protocol errors even when access logging is off"""
+        logger.warning("HTTP error - %s", format % args)
     
     def do_GET(self):
         """Handle GET requests for various endpoints"""
         try:
-            if self.path == '/health':
-                self._handle_health()
-            elif self.path == '/ready':
-                self._handle_readiness()
-            elif self.path == '/metrics':
-                self._handle_metrics()
-            elif self.path == '/cleanup':
-                self._handle_cleanup()
-            elif self.path == '/':
-                self._handle_root()
-            else:
-                self._send_response(404, {"error": "Not found"})
-                
+            getattr(self, self._ROUTES.get(self.path, '_handle_404'))()
         except Exception as e:
             logger.error(f"Error handling request {self.path}: {e}")
             self._send_response(500, {"error": "Internal server error"})
     
     def _handle_health(self):
         """Liveness probe endpoint"""
-        self._send_response(200, {
-            "status": "healthy",
-            "timestamp": datetime.now().isoformat(),
-            "running": self.app.running
-        })
+        if self.app.running:
+            self._send_prebuilt(200, HEALTH_OK)
+        else:
+            self._send_body(200, STOPPING_BODY % self.app.timestamp())
     
     def _handle_readiness(self):
         """Readiness probe endpoint"""
-        ready = self.app.running
-        status_code = 200 if ready else 503
-        
-        self._send_response(status_code, {
-            "status": "ready" if ready else "not ready",
-            "timestamp": datetime.now().isoformat()
-        })
+        if self.app.running:
+            self._send_prebuilt(200, READY_OK)
+        else:
+            self._send_prebuilt(503, NOT_READY)
     
     def _handle_metrics(self):
         """Metrics endpoint for monitoring"""
@@ -238,34 +414,54 @@ class HealthCheckHandler(BaseHTTPRequestHandler):
         
         self._send_response(status_code, {
             "cleanup": "success" if success else "failed",
-            "timestamp": datetime.now().isoformat()
+            "timestamp": self.app.timestamp().decode()
         })
     
     def _handle_root(self):
         """Root endpoint with application info"""
-        self._send_response(200, {
-            "app": "Memory Leak Test Application",
-            "version": "1.0",
-            "endpoints": {
-                "/health": "Liveness probe",
-                "/ready": "Readiness probe", 
-                "/metrics": "Memory metrics",
-                "/cleanup": "Manual memory cleanup"
-            },
-            "config": {
-                "leak_enabled": self.app.leak_enabled,
-                "max_memory_mb": self.app.max_memory_mb,
-                "leak_rate_mb": self.app.leak_rate_mb
-            }
-        })
+        self._send_body(200, self.app.root_body)
+    
+    def _handle_404(self):
+        """Fallback for unknown paths"""
+        self._send_response(404, {"error": "Not found"})
     
     def _send_response(self, status_code, data):
         """Send JSON response"""
-        self.send_response(status_code)
-        self.send_header('Content-Type', 'application/json')
-        self.send_header('Cache-Control', 'no-cache')
-        self.end_headers()
-        self.wfile.write(json.dumps(data, indent=2).encode())
+        self._send_body(status_code, _dumps(data))
+    
+    def _send_body(self, status_code, body):
+        """Send an already encoded JSON body with a single write"""
+        self.log_request(status_code)
+        self.wfile.write(_build_response(status_code, body))
+    
+    def _send_prebuilt(self, status_code, response):
+        """Send a complete response assembled at startup"""
+        self.log_request(status_code)
+        self.wfile.write(response)
+
+class LeakHTTPServer(ThreadingHTTPServer):
+    """Threaded HTTP server that also drives the app's leak schedule"""
+    
+    def __init__(self, app, *args, **kwargs):
+        self.app = app
+        super().__init__(*args, **kwargs)
+    
+    def serve_until_stopped(self, max_wait=0.5):
+        """
+        Serve requests until the app stops running.
+        
+        Each wait for a request ends when the next leak allocation is due,
+        so allocations keep the configured rate rather than snapping to a
+        fixed polling grid. Waits are capped at max_wait seconds so a
+        shutdown signal is noticed promptly.
+        
+        Args:
+            max_wait (float): Longest time to wait for a request, in seconds
+        """
+        while self.app.running:
+            wait = self.app.memory_leak_tick()
+            self.timeout = max_wait if wait is None else min(max_wait, wait)
+            self.handle_request()
 
 def create_handler(app):
     """Factory function to create handler with app reference"""
@@ -279,25 +475,21 @@ def main():
         # Initialize application
         app = MemoryLeakApp()
         
-        # Start memory leak worker in background thread
+        # Start HTTP server; its loop also runs the memory leak schedule
+        handler = create_handler(app)
+        server = LeakHTTPServer(app, ('0.0.0.0', app.port), handler)
+        
         if app.leak_enabled:
-            leak_thread = threading.Thread(target=app._memory_leak_worker, daemon=True)
-            leak_thread.start()
             logger.info("Memory leak simulation started")
         else:
             logger.info("Memory leak simulation disabled")
         
-        # Start HTTP server
-        handler = create_handler(app)
-        server = HTTPServer(('0.0.0.0', app.port), handler)
-        
         logger.info(f"HTTP server starting on port {app.port}")
         logger.info("Application ready to serve requests")
         
-        # Run server until shutdown signal
-        while app.running:
-            server.timeout = 1.0
-            server.handle_request()
+        # Serve requests concurrently until a shutdown signal stops the loop;
+        # the loop wakes up exactly when each leak allocation is due
+        server.serve_until_stopped()
         
         logger.info("Shutting down HTTP server...")
         server.server_close()